@@ -1,18 +1,41 @@
 # Enhanced Port Scanner with additional features
 import socket
+import asyncio
+import selectors
+import errno
+import struct
+import os
+import heapq
 import concurrent.futures
+import multiprocessing
+import queue
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from collections import deque
+from array import array
+from operator import itemgetter
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TimeElapsedColumn
 from rich.prompt import Prompt, IntPrompt, Confirm
-from tqdm import tqdm
-import argparse
 import json
 import csv
 import time
 from datetime import datetime
-import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # Optional Cython build of the connect sweep, see _scanner.pyx
+    from _scanner import scan as _fast_scan
+except ImportError:
+    _fast_scan = None
 
 console = Console()
 
@@ -25,56 +48,331 @@ COMMON_SERVICES = {
     6379: "Redis", 27017: "MongoDB", 8080: "HTTP-Alt", 9200: "Elasticsearch"
 }
 
+# Port-indexed service names, so open-port lookups skip hashing
+SERVICE_TABLE = ["Unknown"] * 65536
+for _port, _name in COMMON_SERVICES.items():
+    SERVICE_TABLE[_port] = _name
+SERVICE_TABLE = tuple(SERVICE_TABLE)
+
+# SO_LINGER {on, 0s}: closing sends RST, so the local port skips TIME_WAIT
+LINGER_RESET = struct.pack('ii', 1, 0)
+
+# Descriptors kept free beyond the max_workers scan sockets, for stdio, the
+# selector or event loop and the shard pool's pipes. Banner connections are
+# among the max_workers sockets, not extra.
+FD_HEADROOM = 256
+
+# Scans at least this wide are split across one process per CPU
+SHARD_MIN_PORTS = 4096
+
 class PortScanner:
     def __init__(self):
-        self.results = []
+        # Open ports as parallel arrays sorted by port
+        self.ports = array('i')
+        self.services = []
+        self.banners = []
+        self._banner_cells = []  # banners truncated for the results table
         self.start_time = None
         self.end_time = None
+        self._recv_buffers = []
+        self._http_probe = None
+        # Shard workers, kept alive across scans
+        self._pool = None
+        self._pool_size = 0
+        self._updates = None  # progress counts reported back by shard workers
+        self._scan_id = 0  # tags queue messages so a scan ignores an earlier one's stragglers
         
-    def banner_grab(self, host, port, timeout=2):
-        """Attempt to grab service banner"""
+    def _set_http_probe(self, host):
+        """Build the HTTP request sent to web ports once per scan"""
+        self._http_probe = (
+            b"GET / HTTP/1.1\r\nHost: " + host.encode() +
+            b"\r\nUser-Agent: VestaS\r\nConnection: close\r\n\r\n"
+        )
+
+    async def banner_grab(self, s, port, timeout=2):
+        """Attempt to grab service banner over an open connection"""
+        loop = asyncio.get_running_loop()
+        # Concurrent probes each need their own buffer, so recycle them through a free list
+        buf = self._recv_buffers.pop() if self._recv_buffers else bytearray(1024)
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(timeout)
-            s.connect((host, port))
-            
             # Send HTTP request for web services
             if port in [80, 443, 8080, 8443]:
-                s.send(b"GET / HTTP/1.1\r\nHost: " + host.encode() + b"\r\n\r\n")
-            
-            banner = s.recv(1024).decode('utf-8', errors='ignore').strip()
-            s.close()
+                # Push the probe out in one segment rather than waiting on Nagle
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                await loop.sock_sendall(s, self._http_probe)
+
+            n = await asyncio.wait_for(loop.sock_recv_into(s, buf), timeout)
+            banner = buf[:n].decode('utf-8', errors='ignore').strip()
             return banner[:100] if banner else "No banner"
-        except:
+        except (OSError, asyncio.TimeoutError):
+            # Cancellation must propagate so an interrupted scan stops pulling ports
             return "No banner"
+        finally:
+            self._recv_buffers.append(buf)
+
+    def _scan_epoll(self, ip, ports, window=2048, timeout=0.5, progress=None, task=None):
+        """Connect sweep over non-blocking sockets multiplexed by one selector"""
+        if _fast_scan is not None:
+            advance = (lambda n: progress.update(task, advance=n)) if progress is not None else None
+            return _fast_scan(socket.inet_aton(ip), array('i', ports), int(timeout * 1000), window, advance)
+
+        sel = selectors.DefaultSelector()
+        pending = iter(ports)
+        inflight = deque()  # (deadline, sock) in connect order, so deadlines are ascending
+        live = set()
+        open_ports = []
+        done = 0
+        last_update = time.monotonic()
+
+        def finish(s, port=None):
+            nonlocal done
+            sel.unregister(s)
+            live.discard(s)
+            if port is not None:
+                # Only established connections would enter TIME_WAIT on close
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_RESET)
+                open_ports.append(port)
+            s.close()
+            done += 1
+
+        try:
+            while True:
+                # Refill the in-flight window
+                while len(sel.get_map()) < window:
+                    port = next(pending, None)
+                    if port is None:
+                        break
+                    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    s.setblocking(False)
+                    result = s.connect_ex((ip, port))
+                    sel.register(s, selectors.EVENT_WRITE, port)
+                    if result == 0:
+                        finish(s, port)
+                    elif result in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                        live.add(s)
+                        inflight.append((time.monotonic() + timeout, s))
+                    else:
+                        finish(s)
+
+                if not sel.get_map():
+                    break
+
+                wait = max(inflight[0][0] - time.monotonic(), 0) if inflight else None
+                for key, _ in sel.select(wait):
+                    s = key.fileobj
+                    err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    finish(s, key.data if err == 0 else None)
+
+                # Expire connects that outlived the timeout
+                now = time.monotonic()
+                while inflight and (inflight[0][1] not in live or inflight[0][0] <= now):
+                    _, s = inflight.popleft()
+                    if s in live:
+                        finish(s)
+
+                # Batch progress updates so console rendering stays off the hot path
+                if progress is not None and (done >= 128 or now - last_update >= 0.1):
+                    progress.update(task, advance=done)
+                    done = 0
+                    last_update = now
+        finally:
+            for key in list(sel.get_map().values()):
+                key.fileobj.close()
+            sel.close()
+
+        if progress is not None and done:
+            progress.update(task, advance=done)
+
+        return open_ports
+
+    async def _connect(self, s, addr, timeout):
+        """Non-blocking connect on the running loop, returns the errno (0 when open)"""
+        # Refused connects come back as a code, so closed ports never raise
+        err = s.connect_ex(addr)
+        if err not in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            return err
+
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_writer(s, lambda: ready.done() or ready.set_result(None))
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            return errno.ETIMEDOUT
+        finally:
+            loop.remove_writer(s)
+        return s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+    async def _grab_banners(self, host, ip, ports, max_workers, progress=None, task=None, timeout=0.5):
+        """Connect and grab banners in one pass, reading each banner as soon as its port connects"""
+        # A fixed set of workers drains one shared iterator, so no per-port task is created
+        # and no more than max_workers sockets are ever open
+        pending = iter(ports)
+        results = []
+        done = 0
+        last_update = time.monotonic()
+        self._set_http_probe(host)
+
+        async def worker():
+            nonlocal done, last_update
+            for port in pending:
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                    s.setblocking(False)
+                    # Set before connecting so the small window is what gets advertised
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+                    if await self._connect(s, (ip, port), timeout) == 0:
+                        # Only established connections would enter TIME_WAIT on close
+                        s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_RESET)
+                        banner = await self.banner_grab(s, port)
+                        results.append((port, SERVICE_TABLE[port], banner))
+
+                # Batch progress updates so console rendering stays off the hot path
+                done += 1
+                now = time.monotonic()
+                if progress is not None and (done >= 128 or now - last_update >= 0.1):
+                    progress.update(task, advance=done)
+                    done = 0
+                    last_update = now
+
+        await asyncio.gather(*(worker() for _ in range(min(max_workers, len(ports)))))
+        if progress is not None and done:
+            progress.update(task, advance=done)
+        return results
+
+    def _scan_ports(self, host, ip, ports, max_workers, grab_banner, progress, task):
+        """Scan ports in this process, or sharded across processes for wide scans"""
+        limit = _raise_nofile_limit(max_workers + FD_HEADROOM)
+        max_workers = max(min(max_workers, limit - FD_HEADROOM), 1)
+        shards = os.cpu_count() or 1
+        if shards > 1 and len(ports) >= SHARD_MIN_PORTS:
+            return self._scan_sharded(host, ip, ports, shards, max_workers, grab_banner, progress, task)
+        return self._sweep_ports(host, ip, ports, max_workers, grab_banner, progress, task)
+
+    def _scan_sharded(self, host, ip, ports, shards, max_workers, grab_banner, progress, task):
+        """Run contiguous slices of the port list in worker processes and merge the rows"""
+        step = -(-len(ports) // shards)
+        chunks = [ports[i:i + step] for i in range(0, len(ports), step)]
+        # Split the connection budget so the total in flight stays at max_workers
+        per_shard = max(max_workers // len(chunks), 1)
+
+        self._scan_id += 1
+        pool = self._get_pool(len(chunks))
+        self._drain_updates()
+
+        def submit(pool):
+            return [
+                pool.submit(_scan_shard, self._scan_id, host, ip, chunk, per_shard, grab_banner)
+                for chunk in chunks
+            ]
+
+        try:
+            futures = submit(pool)
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died while the pool sat idle between scans, so retry once on a fresh pool
+            self.close()
+            futures = submit(self._get_pool(len(chunks)))
+        try:
+            return self._collect_shards(futures, progress, task)
+        except concurrent.futures.process.BrokenProcessPool:
+            # Drop the dead pool so the next scan starts a fresh one
+            self.close()
+            raise
+
+    def _drain_updates(self):
+        """Discard messages an interrupted scan's shards left on the progress queue"""
+        while True:
+            try:
+                self._updates.get_nowait()
+            except queue.Empty:
+                return
+
+    def _collect_shards(self, futures, progress, task):
+        """Forward shard progress until every shard is done, then merge their rows"""
+        # Shards send batched counts, then None once they are done, each tagged with the scan id
+        finished = 0
+        while finished < len(futures):
+            try:
+                scan_id, count = self._updates.get(timeout=0.1)
+            except queue.Empty:
+                # A dead worker never sends its marker
+                if any(f.done() and isinstance(f.exception(), concurrent.futures.process.BrokenProcessPool)
+                       for f in futures):
+                    break
+                continue
+            if scan_id != self._scan_id:
+                continue
+            if count is None:
+                finished += 1
+            else:
+                progress.update(task, advance=count)
+
+        return list(heapq.merge(*(f.result() for f in futures), key=itemgetter(0)))
+
+    def _get_pool(self, size):
+        """Return the shard process pool, recreating it when the size changes"""
+        if self._pool is None or self._pool_size != size:
+            self.close()
+            # Spawn rather than fork: Rich's refresh thread is running when the pool starts
+            ctx = multiprocessing.get_context('spawn')
+            self._updates = ctx.Queue()
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=size, mp_context=ctx,
+                initializer=_init_shard_worker, initargs=(self._updates,)
+            )
+            self._pool_size = size
+        return self._pool
+
+    def close(self):
+        """Shut down the shard process pool"""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+            self._pool_size = 0
+            self._updates.close()
+            self._updates = None
+
+    def _sweep_ports(self, host, ip, ports, max_workers, grab_banner, progress, task):
+        """Sweep ports with the selector loop, or connect and read banners in one pass"""
+        if grab_banner:
+            return asyncio.run(self._grab_banners(host, ip, ports, max_workers, progress, task))
+
+        open_ports = self._scan_epoll(ip, ports, window=max_workers, progress=progress, task=task)
+        return [
+            (p, SERVICE_TABLE[p], "Not captured")
+            for p in open_ports
+        ]
 
     def scan_port(self, host, port, grab_banner=False):
-        """Enhanced port scanning with optional banner grabbing"""
+        """Scan a single port, returns (port, service, banner) or None"""
+        if not 1 <= port <= 65535:
+            return None
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(0.5)
-            result = s.connect_ex((host, port))
-            s.close()
-            
-            if result == 0:  # Port is open
-                service = COMMON_SERVICES.get(port, "Unknown")
-                banner = self.banner_grab(host, port) if grab_banner else "Not captured"
-                return {
-                    'port': port,
-                    'service': service,
-                    'banner': banner,
-                    'status': 'Open'
-                }
-        except:
-            pass
-        return None
+            ip = socket.gethostbyname(host)
+        except OSError:
+            return None
+        rows = self._sweep_ports(host, ip, [port], 1, grab_banner, None, None)
+        return rows[0] if rows else None
 
-    def scan_range(self, host, start_port=1, end_port=1024, max_workers=100, grab_banner=False):
+    def _store_results(self, rows):
+        """Split (port, service, banner) rows into the port-sorted result arrays"""
+        # Sort in place on a C-level key; sharded rows arrive presorted, which timsort finishes in one pass
+        rows.sort(key=itemgetter(0))
+        self.ports = array('i', map(itemgetter(0), rows))
+        self.services = list(map(itemgetter(1), rows))
+        self.banners = list(map(itemgetter(2), rows))
+        self._banner_cells = [b[:40] + "..." if len(b) > 40 else b for b in self.banners]
+
+    def scan_range(self, host, start_port=1, end_port=1024, max_workers=1000, grab_banner=False):
         """Scan a range of ports"""
         self.start_time = datetime.now()
-        open_ports = []
+        self.end_time = None
+        # Ports outside 1-65535 can't be connected to
+        start_port = max(start_port, 1)
+        end_port = min(end_port, 65535)
+        # Resolve once so workers never hit the resolver
+        ip = socket.gethostbyname(host)
         
-        console.print(Panel(f"[bold cyan]🔍 Scanning {host} | Ports: {start_port}-{end_port} | Workers: {max_workers}[/bold cyan]"))
+        console.print(Panel(f"[bold cyan]🔍 Scanning {host} | Ports: {start_port}-{end_port} | Concurrency: {max_workers}[/bold cyan]"))
         
         with Progress(
             SpinnerColumn(),
@@ -85,27 +383,18 @@ class PortScanner:
             console=console
         ) as progress:
             
-            task = progress.add_task("Scanning ports...", total=end_port-start_port+1)
-            
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = {
-                    executor.submit(self.scan_port, host, p, grab_banner): p 
-                    for p in range(start_port, end_port + 1)
-                }
-                
-                for future in concurrent.futures.as_completed(futures):
-                    result = future.result()
-                    if result:
-                        open_ports.append(result)
-                    progress.advance(task)
+            task = progress.add_task("Scanning ports...", total=max(end_port-start_port+1, 0))
+            open_ports = self._scan_ports(
+                host, ip, range(start_port, end_port + 1), max_workers, grab_banner, progress, task
+            )
         
         self.end_time = datetime.now()
-        self.results = sorted(open_ports, key=lambda x: x['port'])
-        return self.results
+        self._store_results(open_ports)
+        return list(zip(self.ports, self.services, self.banners))
 
     def display_results(self):
         """Display results in a formatted table"""
-        if not self.results:
+        if not self.ports:
             console.print("[red]❌ No open ports found[/red]")
             return
         
@@ -115,45 +404,93 @@ class PortScanner:
         table.add_column("Status", justify="center", style="bold green")
         table.add_column("Banner", justify="left", style="yellow", max_width=40)
         
-        for result in self.results:
-            table.add_row(
-                str(result['port']),
-                result['service'],
-                result['status'],
-                result['banner'][:40] + "..." if len(result['banner']) > 40 else result['banner']
-            )
+        for port, service, banner in zip(self.ports, self.services, self._banner_cells):
+            table.add_row(str(port), service, 'Open', banner)
         
         console.print(table)
         
         # Summary
         scan_time = (self.end_time - self.start_time).total_seconds()
-        console.print(f"\n[bold green]✅ Found {len(self.results)} open ports in {scan_time:.2f} seconds[/bold green]")
+        console.print(f"\n[bold green]✅ Found {len(self.ports)} open ports in {scan_time:.2f} seconds[/bold green]")
 
     def save_results(self, filename, format_type="json"):
         """Save results to file in different formats"""
-        if not self.results:
+        if not self.ports:
             console.print("[red]No results to save[/red]")
             return
         
         try:
             if format_type.lower() == "json":
-                with open(filename, 'w') as f:
-                    json.dump({
-                        'scan_time': self.start_time.isoformat(),
-                        'duration': (self.end_time - self.start_time).total_seconds(),
-                        'results': self.results
-                    }, f, indent=2)
+                payload = {
+                    'scan_time': self.start_time.isoformat(),
+                    'duration': (self.end_time - self.start_time).total_seconds(),
+                    'results': [
+                        {'port': p, 'service': svc, 'banner': banner, 'status': 'Open'}
+                        for p, svc, banner in zip(self.ports, self.services, self.banners)
+                    ]
+                }
+                if orjson is not None:
+                    with open(filename, 'wb') as f:
+                        f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+                else:
+                    with open(filename, 'w', encoding='utf-8') as f:
+                        json.dump(payload, f, indent=2, ensure_ascii=False)
             
             elif format_type.lower() == "csv":
                 with open(filename, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=['port', 'service', 'status', 'banner'])
-                    writer.writeheader()
-                    writer.writerows(self.results)
+                    writer = csv.writer(f)
+                    writer.writerow(['port', 'service', 'status', 'banner'])
+                    writer.writerows(
+                        (p, svc, 'Open', banner)
+                        for p, svc, banner in zip(self.ports, self.services, self.banners)
+                    )
             
             console.print(f"[green]💾 Results saved to {filename}[/green]")
         except Exception as e:
             console.print(f"[red]❌ Error saving file: {e}[/red]")
 
+def _raise_nofile_limit(wanted):
+    """Lift the soft open-file limit towards wanted, returns the limit in effect"""
+    if resource is None:
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= wanted:
+        return wanted
+    target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ValueError, OSError):
+        return soft
+    return target
+
+# Progress queue handed to each shard worker by _init_shard_worker
+_shard_updates = None
+
+def _init_shard_worker(updates):
+    """Process pool initializer, keeps the parent's progress queue"""
+    global _shard_updates
+    _shard_updates = updates
+
+class _QueueProgress:
+    """Stands in for rich.Progress in shard workers, forwarding counts to the parent"""
+    def __init__(self, updates, scan_id):
+        self._updates = updates
+        self._scan_id = scan_id
+
+    def update(self, task, advance=0):
+        self._updates.put((self._scan_id, advance))
+
+def _scan_shard(scan_id, host, ip, ports, max_workers, grab_banner):
+    """Process pool entry point, returns the shard's rows sorted by port"""
+    try:
+        rows = PortScanner()._sweep_ports(
+            host, ip, ports, max_workers, grab_banner, _QueueProgress(_shard_updates, scan_id), None
+        )
+    finally:
+        _shard_updates.put((scan_id, None))
+    rows.sort(key=itemgetter(0))
+    return rows
+
 def get_scan_options():
     """Interactive menu for scan options"""
     console.print(Panel("[bold yellow]🛠️  Port Scanner Configuration[/bold yellow]"))
@@ -182,7 +519,7 @@ def get_scan_options():
         return target, specific_ports, None, None
     
     # Advanced options
-    max_workers = IntPrompt.ask("🔧 Number of threads", default=100)
+    max_workers = IntPrompt.ask("🔧 Max concurrent connections", default=1000)
     grab_banner = Confirm.ask("🏷️  Grab service banners?", default=False)
     
     return target, None, (start_port, end_port), {'max_workers': max_workers, 'grab_banner': grab_banner}
@@ -190,28 +527,24 @@ def get_scan_options():
 def scan_specific_ports(scanner, host, ports, **kwargs):
     """Scan specific ports"""
     scanner.start_time = datetime.now()
-    results = []
+    scanner.end_time = None
+    skipped = [p for p in ports if not 1 <= p <= 65535]
+    ports = [p for p in ports if 1 <= p <= 65535]
+    ip = socket.gethostbyname(host)
     
     console.print(Panel(f"[bold cyan]🔍 Scanning specific ports on {host}[/bold cyan]"))
+    if skipped:
+        console.print(f"[yellow]Skipping invalid ports: {', '.join(map(str, skipped))}[/yellow]")
     
     with Progress() as progress:
         task = progress.add_task("Scanning ports...", total=len(ports))
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=kwargs.get('max_workers', 50)) as executor:
-            futures = {
-                executor.submit(scanner.scan_port, host, p, kwargs.get('grab_banner', False)): p 
-                for p in ports
-            }
-            
-            for future in concurrent.futures.as_completed(futures):
-                result = future.result()
-                if result:
-                    results.append(result)
-                progress.advance(task)
+        results = scanner._scan_ports(
+            host, ip, ports, kwargs.get('max_workers', 1000), kwargs.get('grab_banner', False), progress, task
+        )
     
     scanner.end_time = datetime.now()
-    scanner.results = sorted(results, key=lambda x: x['port'])
-    return scanner.results
+    scanner._store_results(results)
+    return list(zip(scanner.ports, scanner.services, scanner.banners))
 
 def main():
     console.print(Panel.fit("[bold blue]🚀 Enhanced Port Scanner v2.0[/bold blue]", border_style="blue"))
@@ -232,7 +565,7 @@ def main():
         scanner.display_results()
         
         # Option to save results
-        if scanner.results and Confirm.ask("\n💾 Save results to file?", default=False):
+        if scanner.ports and Confirm.ask("\n💾 Save results to file?", default=False):
             filename = Prompt.ask("📁 Enter filename", default=f"scan_{target}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
             format_choice = Prompt.ask("📄 Choose format", choices=["json", "csv"], default="json")
             
@@ -245,6 +578,8 @@ def main():
         console.print("\n[red]⚠️  Scan interrupted by user[/red]")
     except Exception as e:
         console.print(f"[red]❌ Error: {e}[/red]")
+    finally:
+        scanner.close()
 
 if __name__ == "__main__":
     main()
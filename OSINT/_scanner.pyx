@@ -0,0 +1,233 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Optional C implementation of the PortScanner connect sweep (Linux, epoll)
+
+Build in place next to VestaS.py with:  cythonize -i _scanner.pyx
+VestaS falls back to the pure-Python selector loop when this isn't built.
+"""
+from libc.stdlib cimport malloc, free
+from libc.string cimport memcpy, strerror
+from libc.errno cimport errno, EINPROGRESS, EINTR
+from posix.unistd cimport close
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
+from cpython.exc cimport PyErr_CheckSignals
+
+
+cdef extern from "<sys/socket.h>" nogil:
+    ctypedef unsigned int socklen_t
+    struct sockaddr:
+        pass
+    struct linger:
+        int l_onoff
+        int l_linger
+    enum:
+        AF_INET
+        SOCK_STREAM
+        SOCK_NONBLOCK
+        SOL_SOCKET
+        SO_ERROR
+        SO_LINGER
+    int socket(int domain, int type, int protocol)
+    int connect(int fd, const sockaddr *addr, socklen_t addrlen)
+    int getsockopt(int fd, int level, int optname, void *optval, socklen_t *optlen)
+    int setsockopt(int fd, int level, int optname, const void *optval, socklen_t optlen)
+
+
+cdef extern from "<netinet/in.h>" nogil:
+    struct in_addr:
+        unsigned int s_addr
+    struct sockaddr_in:
+        unsigned short sin_family
+        unsigned short sin_port
+        in_addr sin_addr
+    unsigned short htons(unsigned short hostshort)
+
+
+cdef extern from "<sys/epoll.h>" nogil:
+    union epoll_data:
+        void *ptr
+        int fd
+        unsigned int u32
+        unsigned long long u64
+    struct epoll_event:
+        unsigned int events
+        epoll_data data
+    enum:
+        EPOLL_CTL_ADD
+        EPOLLOUT
+        EPOLL_CLOEXEC
+    int epoll_create1(int flags)
+    int epoll_ctl(int epfd, int op, int fd, epoll_event *event)
+    int epoll_wait(int epfd, epoll_event *events, int maxevents, int timeout)
+
+
+cdef inline long long now_ms() nogil:
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec * 1000 + ts.tv_nsec // 1000000
+
+
+def scan(bytes ip, const int[::1] ports, int timeout_ms=500, int window=2048, progress=None):
+    """Connect sweep over ports, returns the open ones
+
+    ip is a packed IPv4 address (socket.inet_aton), ports an array('i').
+    progress, if given, is called with the number of newly finished ports.
+    """
+    cdef Py_ssize_t n = ports.shape[0]
+    cdef Py_ssize_t next_port = 0, n_open = 0, i
+    cdef int active = 0, done = 0, n_free, slot, fd, port, ret, ready, wait, err
+    cdef linger reset
+    cdef socklen_t errlen
+    cdef long long now, last_update
+    cdef sockaddr_in addr
+    cdef epoll_event ev
+    cdef int epfd = -1
+    cdef int *fds = NULL
+    cdef int *slot_port = NULL
+    cdef int *free_slots = NULL
+    cdef int *open_ports = NULL
+    cdef long long *deadline = NULL
+    cdef epoll_event *events = NULL
+
+    if len(ip) != 4:
+        raise ValueError("ip must be a packed IPv4 address")
+    # htons would silently wrap anything outside the TCP port range
+    for i in range(n):
+        if ports[i] < 1 or ports[i] > 65535:
+            raise ValueError(f"port out of range: {ports[i]}")
+    if n == 0:
+        return []
+    if window > n:
+        window = <int>n
+    if window < 1:
+        window = 1
+
+    # Closing an established connection sends RST, so the local port skips TIME_WAIT
+    reset.l_onoff = 1
+    reset.l_linger = 0
+
+    addr.sin_family = AF_INET
+    memcpy(&addr.sin_addr, <const char *>ip, 4)
+
+    try:
+        fds = <int *>malloc(window * sizeof(int))
+        if fds != NULL:
+            for i in range(window):
+                fds[i] = -1
+        slot_port = <int *>malloc(window * sizeof(int))
+        free_slots = <int *>malloc(window * sizeof(int))
+        deadline = <long long *>malloc(window * sizeof(long long))
+        events = <epoll_event *>malloc(window * sizeof(epoll_event))
+        open_ports = <int *>malloc(n * sizeof(int))
+        if (fds == NULL or slot_port == NULL or free_slots == NULL or deadline == NULL
+                or events == NULL or open_ports == NULL):
+            raise MemoryError()
+
+        for i in range(window):
+            free_slots[i] = window - 1 - i
+        n_free = window
+
+        epfd = epoll_create1(EPOLL_CLOEXEC)
+        if epfd < 0:
+            raise OSError(errno, strerror(errno).decode())
+
+        last_update = now_ms()
+        while True:
+            # Refill the in-flight window
+            while n_free > 0 and next_port < n:
+                port = ports[next_port]
+                next_port += 1
+                fd = socket(AF_INET, SOCK_STREAM | SOCK_NONBLOCK, 0)
+                if fd < 0:
+                    raise OSError(errno, strerror(errno).decode())
+
+                addr.sin_port = htons(<unsigned short>port)
+                ret = connect(fd, <sockaddr *>&addr, sizeof(addr))
+                if ret == 0:
+                    setsockopt(fd, SOL_SOCKET, SO_LINGER, &reset, sizeof(reset))
+                    open_ports[n_open] = port
+                    n_open += 1
+                    close(fd)
+                    done += 1
+                elif errno == EINPROGRESS:
+                    n_free -= 1
+                    slot = free_slots[n_free]
+                    fds[slot] = fd
+                    slot_port[slot] = port
+                    deadline[slot] = now_ms() + timeout_ms
+                    ev.events = EPOLLOUT
+                    ev.data.u32 = slot
+                    if epoll_ctl(epfd, EPOLL_CTL_ADD, fd, &ev) < 0:
+                        raise OSError(errno, strerror(errno).decode())
+                    active += 1
+                else:
+                    close(fd)
+                    done += 1
+
+            if active == 0:
+                break
+
+            now = now_ms()
+            wait = timeout_ms
+            for i in range(window):
+                if fds[i] >= 0 and deadline[i] - now < wait:
+                    wait = <int>(deadline[i] - now)
+            if wait < 0:
+                wait = 0
+
+            with nogil:
+                ready = epoll_wait(epfd, events, window, wait)
+            if ready < 0:
+                if errno == EINTR:
+                    PyErr_CheckSignals()
+                    continue
+                raise OSError(errno, strerror(errno).decode())
+
+            for i in range(ready):
+                slot = events[i].data.u32
+                err = 0
+                errlen = sizeof(err)
+                getsockopt(fds[slot], SOL_SOCKET, SO_ERROR, &err, &errlen)
+                if err == 0:
+                    setsockopt(fds[slot], SOL_SOCKET, SO_LINGER, &reset, sizeof(reset))
+                    open_ports[n_open] = slot_port[slot]
+                    n_open += 1
+                close(fds[slot])
+                fds[slot] = -1
+                free_slots[n_free] = slot
+                n_free += 1
+                active -= 1
+                done += 1
+
+            # Expire connects that outlived the timeout
+            now = now_ms()
+            for i in range(window):
+                if fds[i] >= 0 and deadline[i] <= now:
+                    close(fds[i])
+                    fds[i] = -1
+                    free_slots[n_free] = i
+                    n_free += 1
+                    active -= 1
+                    done += 1
+
+            if progress is not None and (done >= 128 or now - last_update >= 100):
+                progress(done)
+                done = 0
+                last_update = now
+
+        if progress is not None and done:
+            progress(done)
+        return [open_ports[i] for i in range(n_open)]
+    finally:
+        if fds != NULL:
+            for i in range(window):
+                if fds[i] >= 0:
+                    close(fds[i])
+        if epfd >= 0:
+            close(epfd)
+        free(fds)
+        free(slot_port)
+        free(free_slots)
+        free(deadline)
+        free(events)
+        free(open_ports)